@@ -4,7 +4,6 @@ import gspread
 import pandas as pd
 import json
 import re
-import ast
 import io
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
@@ -12,6 +11,8 @@ import pypdf
 from pptx import Presentation
 from pptx.enum.shapes import MSO_SHAPE_TYPE
 import difflib
+from google.generativeai import caching
+from search import CatalogCacheStore, search_catalog, search_catalog_batch, split_brief
 
 # --- CONFIGURAZIONE PAJINA (WIDE MODE) ---
 st.set_page_config(layout="wide", page_title="MasterTb Manager", page_icon="🦁")
@@ -251,37 +252,60 @@ def analyze_document_with_gemini(text_content, columns):
         st.error(f"Errore AI ({DOC_MODEL}): {e}")
         return {}
 
-def search_ai(query, dataframe):
-    if "GOOGLE_API_KEY" not in st.secrets: return []
+SEARCH_GENERATION_CONFIG = {"temperature": 0.1}
+
+class GeminiSearchClient:
+    """Accesso a Gemini per la ricerca. Nei test si può passare un fake con gli stessi metodi."""
+
+    def create_cache(self, system_instruction, content, ttl):
+        cache = caching.CachedContent.create(
+            model=SEARCH_MODEL,
+            display_name="mastertb-catalogo",
+            system_instruction=system_instruction,
+            contents=[content],
+            ttl=ttl
+        )
+        # Si conserva l'oggetto: con il solo nome from_cached_content rifarebbe una get ad ogni ricerca
+        return cache
+
+    def delete_cache(self, cache):
+        cache.delete()
+
+    def generate(self, prompt, cache=None, system_instruction=None):
+        if cache:
+            model = genai.GenerativeModel.from_cached_content(
+                cached_content=cache,
+                generation_config=SEARCH_GENERATION_CONFIG
+            )
+        else:
+            model = genai.GenerativeModel(
+                model_name=SEARCH_MODEL,
+                generation_config=SEARCH_GENERATION_CONFIG,
+                system_instruction=system_instruction
+            )
+        return model.generate_content(prompt)
+
+@st.cache_resource
+def get_catalog_cache_store():
+    # Condivisa tra sessioni e utenti: una sola cache Gemini per versione del catalogo
+    return CatalogCacheStore()
+
+def _default_search_client():
+    if "GOOGLE_API_KEY" not in st.secrets: return None
     genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
-    
-    context_str = dataframe.to_markdown(index=True)
-    
-    sys_prompt = """
-    Sei un Senior Event Manager esperto in Team Building.
-    Analizza la RICHIESTA dell'utente e trova nel CATALOGO i format più pertinenti.
-    
-    THINKING PROCESS:
-    1. Astrai la richiesta (es. "ponte tibetano" -> "Outdoor/Avventura").
-    2. Cerca per ASSOCIAZIONE DI IDEE.
-    3. Restituisci i NOMI DEI FORMAT (ID colonna 1).
-    
-    Output: SOLO lista Python. Es: ['Format A', 'Format B'].
-    """
-    
-    model = genai.GenerativeModel(
-        model_name=SEARCH_MODEL,
-        generation_config={"temperature": 0.1},
-        system_instruction=sys_prompt
-    )
-    try:
-        response = model.generate_content(f"CATALOGO:\n{context_str}\n\nRICHIESTA UTENTE: {query}")
-        if response.usage_metadata:
-            st.session_state['token_usage']['total'] += response.usage_metadata.total_token_count
-        
-        match = re.search(r"(\[.*\])", response.text.strip(), re.DOTALL)
-        return ast.literal_eval(match.group(1)) if match else []
-    except: return []
+    return GeminiSearchClient()
+
+def search_ai(query, dataframe):
+    client = _default_search_client()
+    if client is None: return []
+    return search_catalog(query, dataframe.to_markdown(index=True), client,
+                          get_catalog_cache_store(), st.session_state['token_usage'])
+
+def search_ai_batch(queries, dataframe):
+    client = _default_search_client()
+    if client is None: return {q: [] for q in queries}
+    return search_catalog_batch(queries, dataframe.to_markdown(index=True), client,
+                                get_catalog_cache_store(), st.session_state['token_usage'])
 
 
 # ==========================================
@@ -351,36 +375,51 @@ with st.sidebar:
 
     # 2. RICERCA
     st.subheader("2. 🔎 Cerca (AI)")
-    q = st.text_input("Es. cucina, outdoor...", label_visibility="collapsed")
+    brief_mode = st.toggle("Brief (più richieste)", help="Una richiesta per riga (o separate da virgola o ';'): una sola chiamata AI per tutto il brief.")
+    if brief_mode:
+        q = st.text_area("Es. attività di benvenuto\noutdoor pomeridiano\nintrattenimento cena di gala", label_visibility="collapsed")
+    else:
+        q = st.text_input("Es. cucina, outdoor...", label_visibility="collapsed")
     if st.button("Cerca Format", use_container_width=True):
         if q:
             with st.spinner("Ricerca..."):
-                res = search_ai(q, df)
-                st.session_state['search_results'] = [x for x in res if x in product_ids] if res else []
+                # Risultati sempre raggruppati per richiesta: {richiesta: [format]}
+                if brief_mode:
+                    grouped = search_ai_batch(split_brief(q), df)
+                else:
+                    grouped = {q: search_ai(q, df)}
+                st.session_state['search_results'] = {
+                    k: [x for x in v if x in product_ids] for k, v in grouped.items()
+                }
 
     # RISULTATI RICERCA
-    if st.session_state['search_results']:
-        st.success(f"Trovati: {len(st.session_state['search_results'])}")
+    if st.session_state['search_results'] and any(st.session_state['search_results'].values()):
+        groups = st.session_state['search_results']
+        st.success(f"Trovati: {len({x for v in groups.values() for x in v})}")
         
         desc_key = "Descrizione Breve"
         for c in cols:
             if "descrizione" in c.lower(): desc_key = c; break
             
-        for rid in st.session_state['search_results']:
-            # Card style in sidebar
-            row_data = df.loc[rid]
-            preview = str(row_data.get(desc_key, ""))[:60] + "..."
-            
-            with st.container():
-                st.markdown(f"""
-                <div class="result-card">
-                    <div class="result-title">{rid}</div>
-                    <div class="result-preview">{preview}</div>
-                </div>
-                """, unsafe_allow_html=True)
-                if st.button("✏️ Modifica", key=f"btn_side_{rid}", use_container_width=True):
-                    st.session_state['force_selection'] = rid
-                    st.rerun()
+        for g_idx, (g_query, g_ids) in enumerate(groups.items()):
+            if len(groups) > 1:
+                st.markdown(f"**{g_query}** ({len(g_ids)})")
+                if not g_ids: st.caption("Nessun format trovato.")
+            for rid in g_ids:
+                # Card style in sidebar
+                row_data = df.loc[rid]
+                preview = str(row_data.get(desc_key, ""))[:60] + "..."
+                
+                with st.container():
+                    st.markdown(f"""
+                    <div class="result-card">
+                        <div class="result-title">{rid}</div>
+                        <div class="result-preview">{preview}</div>
+                    </div>
+                    """, unsafe_allow_html=True)
+                    if st.button("✏️ Modifica", key=f"btn_side_{g_idx}_{rid}", use_container_width=True):
+                        st.session_state['force_selection'] = rid
+                        st.rerun()
         
         if st.button("❌ Reset Ricerca", use_container_width=True):
             st.session_state['search_results'] = None
@@ -0,0 +1,156 @@
+import ast
+import datetime
+import hashlib
+import re
+import threading
+
+# --- RICERCA AI NEL CATALOGO (CON CONTEXT CACHING GEMINI) ---
+# Nessuna dipendenza da Streamlit: il client Gemini, la cache condivisa e il
+# contatore token arrivano come parametri (nei test si passano dei fake).
+
+CATALOG_CACHE_TTL = datetime.timedelta(hours=1)
+# Se la creazione fallisce per un errore temporaneo si riprova presto
+CATALOG_CACHE_RETRY = datetime.timedelta(minutes=2)
+# Margine per non usare una cache che scade durante la richiesta
+CATALOG_CACHE_MARGIN = datetime.timedelta(minutes=1)
+
+SEARCH_SYS_PROMPT = """
+    Sei un Senior Event Manager esperto in Team Building.
+    Analizza la RICHIESTA dell'utente e trova nel CATALOGO i format più pertinenti.
+
+    THINKING PROCESS:
+    1. Astrai la richiesta (es. "ponte tibetano" -> "Outdoor/Avventura").
+    2. Cerca per ASSOCIAZIONE DI IDEE.
+    3. Restituisci i NOMI DEI FORMAT (ID colonna 1).
+
+    Rispetta il formato di Output indicato nel messaggio.
+    """
+SEARCH_OUTPUT_SINGLE = "Output: SOLO lista Python. Es: ['Format A', 'Format B']."
+SEARCH_OUTPUT_BATCH = """Il brief contiene PIÙ RICHIESTE numerate: trattale separatamente.
+Output: SOLO dizionario Python con il numero della richiesta come chiave. Es: {1: ['Format A'], 2: ['Format B', 'Format C']}."""
+
+
+class CatalogCacheStore:
+    """Cache Gemini del catalogo condivisa da tutte le sessioni: una sola per versione."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entry = None  # {'version', 'cache', 'expires'}
+
+
+def catalog_version(context_str, sys_prompt):
+    # Cambia quando cambia il foglio (load_data) o il prompt di sistema
+    return hashlib.sha256(f"{sys_prompt}\n{context_str}".encode("utf-8")).hexdigest()[:16]
+
+
+def _is_cache_too_small(error):
+    # Gemini rifiuta le cache sotto una soglia minima di token (min_total_token_count)
+    msg = str(error).lower()
+    return "too small" in msg or "min_total_token_count" in msg
+
+
+def _is_cache_gone(error):
+    # Cache scaduta/eliminata lato server (NotFound, PermissionDenied). 429, timeout e 5xx non contano
+    if type(error).__name__ in ("NotFound", "PermissionDenied"): return True
+    return "cachedcontent not found" in str(error).lower()
+
+
+def _delete_quietly(client, cache):
+    try: client.delete_cache(cache)
+    except: pass
+
+
+def ensure_catalog_cache(client, store, context_str, sys_prompt=SEARCH_SYS_PROMPT, now=None):
+    """Restituisce la cache Gemini per la versione corrente del catalogo (None = niente cache)."""
+    version = catalog_version(context_str, sys_prompt)
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+
+    with store.lock:
+        cached = store.entry
+        if cached and cached['version'] == version and cached['expires'] > now:
+            return cached['cache']
+
+        try:
+            cache = client.create_cache(sys_prompt, f"CATALOGO:\n{context_str}", CATALOG_CACHE_TTL)
+            expires = now + CATALOG_CACHE_TTL - CATALOG_CACHE_MARGIN
+        except Exception as e:
+            # Catalogo troppo piccolo: niente cache per questa versione. Altri errori: si riprova a breve
+            cache = None
+            expires = now + (CATALOG_CACHE_TTL if _is_cache_too_small(e) else CATALOG_CACHE_RETRY)
+
+        store.entry = {'version': version, 'cache': cache, 'expires': expires}
+
+    # Catalogo cambiato o cache scaduta: la vecchia si elimina fuori dal lock
+    if cached and cached['cache']:
+        _delete_quietly(client, cached['cache'])
+    return cache
+
+
+def invalidate_catalog_cache(client, store, cache):
+    # Cache non più valida lato server: la si elimina e si ricrea alla prossima ricerca
+    with store.lock:
+        if store.entry and store.entry['cache'] is cache:
+            store.entry = None
+    _delete_quietly(client, cache)
+
+
+def search_generate(client, store, context_str, request_text, token_usage=None):
+    """Una sola chiamata al modello: usa la cache del catalogo se disponibile, altrimenti lo invia inline."""
+    cache = ensure_catalog_cache(client, store, context_str)
+
+    response = None
+    if cache:
+        try:
+            response = client.generate(request_text, cache=cache)
+        except Exception as e:
+            # Rate limit o errori temporanei non devono eliminare la cache condivisa
+            if not _is_cache_gone(e): raise
+            invalidate_catalog_cache(client, store, cache)
+    if response is None:
+        response = client.generate(
+            f"CATALOGO:\n{context_str}\n\n{request_text}",
+            system_instruction=SEARCH_SYS_PROMPT
+        )
+    if token_usage is not None and response.usage_metadata:
+        token_usage['total'] += response.usage_metadata.total_token_count
+    return response.text.strip()
+
+
+def search_catalog(query, context_str, client, store, token_usage=None):
+    try:
+        text = search_generate(client, store, context_str, f"RICHIESTA UTENTE: {query}\n\n{SEARCH_OUTPUT_SINGLE}", token_usage)
+        match = re.search(r"(\[.*\])", text, re.DOTALL)
+        return ast.literal_eval(match.group(1)) if match else []
+    except: return []
+
+
+def split_brief(brief):
+    # Una richiesta per riga (o separate da ';' o ','), senza doppioni
+    queries = []
+    for part in re.split(r"[\n;,]+", brief):
+        part = part.strip(" -•\t")
+        if part and part.lower() not in [x.lower() for x in queries]:
+            queries.append(part)
+    return queries
+
+
+def search_catalog_batch(queries, context_str, client, store, token_usage=None):
+    """Risolve tutte le richieste di un brief in una sola chiamata. Ritorna {richiesta: [format]}."""
+    grouped = {q: [] for q in queries}
+    if not queries: return grouped
+
+    numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(queries, 1))
+    try:
+        text = search_generate(client, store, context_str, f"RICHIESTE UTENTE:\n{numbered}\n\n{SEARCH_OUTPUT_BATCH}", token_usage)
+        match = re.search(r"(\{.*\})", text, re.DOTALL)
+        answer = ast.literal_eval(match.group(1)) if match else {}
+    except: return grouped
+    # Es. un set {'Format A', 'Format B'} invece del dizionario richiesto
+    if not isinstance(answer, dict): return grouped
+
+    for i, q in enumerate(queries, 1):
+        found = answer.get(i, answer.get(str(i), []))
+        if not isinstance(found, (list, tuple)): continue
+        for x in found:
+            if x not in grouped[q]: grouped[q].append(x)
+    return grouped
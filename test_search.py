@@ -0,0 +1,167 @@
+import datetime
+from types import SimpleNamespace
+
+from search import (
+    CATALOG_CACHE_RETRY, CATALOG_CACHE_TTL, CatalogCacheStore,
+    ensure_catalog_cache, search_catalog, search_catalog_batch, split_brief,
+)
+
+NOW = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class NotFound(Exception):
+    """Stesso nome dell'eccezione google.api_core per una cache sparita lato server."""
+
+
+class FakeClient:
+    """Finto client Gemini: registra le chiamate e risponde con un testo fisso."""
+
+    def __init__(self, reply="['Format A']", create_error=None, cached_error=None):
+        self.reply = reply
+        self.create_error = create_error
+        self.cached_error = cached_error
+        self.created = []
+        self.deleted = []
+        self.prompts = []
+
+    def create_cache(self, system_instruction, content, ttl):
+        if self.create_error: raise self.create_error
+        cache = f"cachedContents/{len(self.created) + 1}"
+        self.created.append((cache, content))
+        return cache
+
+    def delete_cache(self, cache):
+        self.deleted.append(cache)
+
+    def generate(self, prompt, cache=None, system_instruction=None):
+        self.prompts.append({'prompt': prompt, 'cache': cache, 'system_instruction': system_instruction})
+        if cache and self.cached_error: raise self.cached_error
+        usage = SimpleNamespace(total_token_count=10)
+        return SimpleNamespace(text=self.reply, usage_metadata=usage)
+
+
+# --- CACHE CATALOGO ---
+
+def test_same_catalog_creates_one_cache():
+    client, store = FakeClient(), CatalogCacheStore()
+    token_usage = {'total': 0}
+
+    assert search_catalog("cucina", "| A |", client, store, token_usage) == ['Format A']
+    assert search_catalog("outdoor", "| A |", client, store, token_usage) == ['Format A']
+
+    assert len(client.created) == 1
+    assert all(p['cache'] == "cachedContents/1" for p in client.prompts)
+    assert "CATALOGO" not in client.prompts[1]['prompt']
+    assert token_usage['total'] == 20
+
+
+def test_changed_catalog_replaces_cache():
+    client, store = FakeClient(), CatalogCacheStore()
+
+    search_catalog("cucina", "| A |", client, store)
+    search_catalog("cucina", "| A |\n| B |", client, store)
+
+    assert [cache for cache, _ in client.created] == ["cachedContents/1", "cachedContents/2"]
+    assert client.deleted == ["cachedContents/1"]
+    assert client.prompts[-1]['cache'] == "cachedContents/2"
+
+
+def test_expired_cache_is_recreated():
+    client, store = FakeClient(), CatalogCacheStore()
+
+    assert ensure_catalog_cache(client, store, "| A |", now=NOW) == "cachedContents/1"
+    assert ensure_catalog_cache(client, store, "| A |", now=NOW + datetime.timedelta(minutes=30)) == "cachedContents/1"
+    assert ensure_catalog_cache(client, store, "| A |", now=NOW + CATALOG_CACHE_TTL) == "cachedContents/2"
+
+    assert client.deleted == ["cachedContents/1"]
+
+
+def test_failing_create_cache_falls_back_to_inline_prompt():
+    client, store = FakeClient(create_error=RuntimeError("network down")), CatalogCacheStore()
+
+    assert search_catalog("cucina", "| A |", client, store) == ['Format A']
+
+    prompt = client.prompts[0]
+    assert prompt['cache'] is None
+    assert prompt['prompt'].startswith("CATALOGO:\n| A |")
+    assert prompt['system_instruction']
+
+
+def test_too_small_catalog_disables_cache_for_ttl():
+    error = RuntimeError("400 Cached content is too small. total_token_count=300, min_total_token_count=1024")
+    client, store = FakeClient(create_error=error), CatalogCacheStore()
+
+    assert ensure_catalog_cache(client, store, "| A |", now=NOW) is None
+    assert store.entry['expires'] == NOW + CATALOG_CACHE_TTL
+
+
+def test_transient_create_error_retries_soon():
+    client, store = FakeClient(create_error=RuntimeError("503 unavailable")), CatalogCacheStore()
+
+    assert ensure_catalog_cache(client, store, "| A |", now=NOW) is None
+    assert store.entry['expires'] == NOW + CATALOG_CACHE_RETRY
+
+
+def test_gone_cache_is_deleted_and_search_falls_back_inline():
+    client, store = FakeClient(cached_error=NotFound("CachedContent not found")), CatalogCacheStore()
+
+    assert search_catalog("cucina", "| A |", client, store) == ['Format A']
+
+    assert client.deleted == ["cachedContents/1"]
+    assert store.entry is None
+    assert client.prompts[-1]['cache'] is None
+    assert client.prompts[-1]['prompt'].startswith("CATALOGO:\n| A |")
+
+
+def test_rate_limit_keeps_shared_cache():
+    client, store = FakeClient(cached_error=RuntimeError("429 Resource exhausted")), CatalogCacheStore()
+
+    assert search_catalog("cucina", "| A |", client, store) == []
+
+    assert client.deleted == []
+    assert store.entry['cache'] == "cachedContents/1"
+    assert len(client.prompts) == 1
+
+
+# --- BRIEF (PIÙ RICHIESTE) ---
+
+def test_batch_groups_and_deduplicates_per_query():
+    client, store = FakeClient(reply="{1: ['A', 'A'], '2': ['B']}"), CatalogCacheStore()
+
+    grouped = search_catalog_batch(["benvenuto", "outdoor"], "| A |", client, store)
+
+    assert grouped == {"benvenuto": ['A'], "outdoor": ['B']}
+    assert len(client.prompts) == 1
+    assert "1. benvenuto\n2. outdoor" in client.prompts[0]['prompt']
+
+
+def test_batch_ignores_set_reply():
+    client, store = FakeClient(reply="{'A', 'B'}"), CatalogCacheStore()
+
+    assert search_catalog_batch(["benvenuto", "outdoor"], "| A |", client, store) == {"benvenuto": [], "outdoor": []}
+
+
+def test_batch_skips_non_list_values():
+    client, store = FakeClient(reply="{1: 'A'}"), CatalogCacheStore()
+
+    assert search_catalog_batch(["benvenuto"], "| A |", client, store) == {"benvenuto": []}
+
+
+def test_batch_reply_without_dict():
+    client, store = FakeClient(reply="Nessun format adatto."), CatalogCacheStore()
+
+    assert search_catalog_batch(["benvenuto"], "| A |", client, store) == {"benvenuto": []}
+
+
+def test_split_brief_bullets_and_separators():
+    brief = "- attività di benvenuto\n• outdoor pomeridiano; cena di gala"
+    assert split_brief(brief) == ["attività di benvenuto", "outdoor pomeridiano", "cena di gala"]
+
+
+def test_split_brief_commas():
+    brief = "welcome activity, afternoon outdoor, gala dinner entertainment"
+    assert split_brief(brief) == ["welcome activity", "afternoon outdoor", "gala dinner entertainment"]
+
+
+def test_split_brief_drops_duplicates_ignoring_case():
+    assert split_brief("Cucina\ncucina\n\nOUTDOOR;outdoor") == ["Cucina", "OUTDOOR"]